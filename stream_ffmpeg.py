@@ -6,20 +6,31 @@ topic.txt, visit_info.txt, stream.txtから情報を読み込んで表示
 """
 
 import os
+import re
+import atexit
+import fcntl
+import queue
+import random
 import sys
 import signal
+import threading
+import selectors
+import shutil
 import subprocess
 import datetime
 import time
 import logging
+import logging.handlers
 import json
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-import threading
 
 # ログ設定
 LOG_DIR = Path("stream_logs")
 LOG_DIR.mkdir(exist_ok=True)
-log_filename = LOG_DIR / f"daily_stream_{datetime.datetime.now().strftime('%Y%m%d')}.log"
+# 日付が変わると daily_stream.log.YYYY-MM-DD にローテーション（30日分保持）
+log_filename = LOG_DIR / "daily_stream.log"
 
 # デバッグモードの確認
 DEBUG_MODE = '--debug' in sys.argv
@@ -27,20 +38,113 @@ DEBUG_MODE = '--debug' in sys.argv
 # ログレベル設定
 log_level = logging.DEBUG if DEBUG_MODE else logging.WARNING
 
-logging.basicConfig(
-    level=log_level,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler(log_filename, encoding='utf-8'),
-        logging.StreamHandler(sys.stdout) if DEBUG_MODE else logging.NullHandler()
-    ]
-)
+
+class DropOldestQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler for a bounded queue: when full, drop the oldest record
+
+    A log flood (e.g. FFmpeg spamming errors) then costs a fixed amount of
+    memory and never blocks the caller.
+    """
+
+    def enqueue(self, record):
+        while True:
+            try:
+                self.queue.put_nowait(record)
+                return
+            except queue.Full:
+                try:
+                    self.queue.get_nowait()
+                except queue.Empty:
+                    pass
+
+
+class BoundedQueueListener(logging.handlers.QueueListener):
+    """QueueListener whose stop() waits for room in a full bounded queue"""
+
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel)
+
+
+class DeferredFormatQueueHandler(DropOldestQueueHandler):
+    """Enqueue records as-is and leave formatting to the listener thread
+
+    Only for loggers that never pass exc_info and whose args are immutable.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+class StderrLine:
+    """Raw FFmpeg stderr line, decoded only when something formats it"""
+
+    __slots__ = ('raw',)
+
+    def __init__(self, raw):
+        self.raw = raw
+
+    def __str__(self):
+        return self.raw.decode('utf-8', 'replace')
+
+
+# Keep this process (monitor loop and the log thread started below) on one
+# core and leave the others to FFmpeg. Set before any thread starts so the
+# log thread inherits it.
+FFMPEG_CPUS = set()
+if hasattr(os, 'sched_setaffinity'):
+    _cpus = sorted(os.sched_getaffinity(0))
+    if len(_cpus) > 1:
+        os.sched_setaffinity(0, {_cpus[0]})
+        FFMPEG_CPUS = set(_cpus[1:])
+# FFmpeg and the probes are started through taskset, so they begin on the
+# other cores and every thread they create inherits that mask. Without
+# taskset, _pin_ffmpeg_cpus() moves the streaming FFmpeg after the fact.
+FFMPEG_LAUNCH_PREFIX = []
+if FFMPEG_CPUS and shutil.which('taskset'):
+    FFMPEG_LAUNCH_PREFIX = ['taskset', '-c', ','.join(map(str, sorted(FFMPEG_CPUS)))]
+
+
+# File/console I/O runs on the QueueListener thread; logging calls from the
+# monitor loop only enqueue the record
+_log_formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+# delay=True: the file is opened on the first record, not at import time
+_log_handlers = [logging.handlers.TimedRotatingFileHandler(
+    log_filename, when='midnight', backupCount=30, encoding='utf-8', delay=True)]
+if DEBUG_MODE:
+    _log_handlers.append(logging.StreamHandler(sys.stdout))
+for _h in _log_handlers:
+    _h.setFormatter(_log_formatter)
+
+log_queue = queue.Queue(maxsize=4096)
+log_listener = BoundedQueueListener(log_queue, *_log_handlers, respect_handler_level=True)
+logging.root.setLevel(log_level)
+logging.root.addHandler(DropOldestQueueHandler(log_queue))
+log_listener.start()
+atexit.register(log_listener.stop)
 
 logger = logging.getLogger(__name__)
 
+# FFmpeg stderr goes to one size-rotated file shared by all sessions. Records
+# are batched in a MemoryHandler on a listener thread of their own; WARNING
+# records (RTMP errors, session start/end markers) flush the batch at once.
+FFMPEG_LOG_FILE = LOG_DIR / "ffmpeg_stderr.log"
+_ffmpeg_file_handler = logging.handlers.RotatingFileHandler(
+    FFMPEG_LOG_FILE, maxBytes=10 << 20, backupCount=5, encoding='utf-8', delay=True)
+_ffmpeg_file_handler.setFormatter(logging.Formatter('%(asctime)s %(message)s', '%Y-%m-%d %H:%M:%S'))
+_ffmpeg_log_buffer = logging.handlers.MemoryHandler(
+    capacity=200, flushLevel=logging.WARNING, target=_ffmpeg_file_handler)
+
+ffmpeg_log_queue = queue.Queue(maxsize=4096)
+ffmpeg_log_listener = BoundedQueueListener(ffmpeg_log_queue, _ffmpeg_log_buffer)
+# Standalone logger: not registered globally, never propagates to root
+ffmpeg_log = logging.Logger('ffmpeg_stderr')
+ffmpeg_log.addHandler(DeferredFormatQueueHandler(ffmpeg_log_queue))
+ffmpeg_log_listener.start()
+atexit.register(ffmpeg_log_listener.stop)
+
 
 class StderrWatchdog:
-    """Monitor FFmpeg stderr for hang detection and RTMP error detection"""
+    """Monitor FFmpeg stderr and -progress output for hangs, stalls and RTMP errors"""
 
     # Patterns that indicate the RTMP output connection has died
     RTMP_ERROR_PATTERNS = [
@@ -49,55 +153,280 @@ class StderrWatchdog:
         'av_interleaved_write_frame', 'Output file #0',
         'mux_failed', 'Error writing trailer',
     ]
-
-    def __init__(self, process, timeout=15, stderr_log=None):
+    # A -progress report is summarized into the stderr log this often (sec)
+    PROGRESS_LOG_INTERVAL = 60
+    # Report keys that go into that one-line summary, in output order
+    PROGRESS_LOG_KEYS = (b'frame', b'fps', b'bitrate', b'total_size', b'out_time',
+                         b'dup_frames', b'drop_frames', b'speed')
+    # Requested stderr pipe capacity (bytes)
+    PIPE_SIZE = 1 << 20
+    # Every stderr line is classified by one scan of this pattern; the
+    # matching group's name says what kind of line it is. stderr is read as
+    # raw bytes, so the pattern is bytes too.
+    #   non_monotonic: timestamp warning repeated for every affected packet
+    #                  ("Non-monotonous DTS" up to FFmpeg 4.x, "Non-monotonic
+    #                  DTS" later)
+    #   rtmp:          any of RTMP_ERROR_PATTERNS
+    LINE_CLASS_RE = re.compile(
+        rb'(?P<non_monotonic>[Nn]on-monoton)|(?P<rtmp>' +
+        b'|'.join(re.escape(p.encode()) for p in RTMP_ERROR_PATTERNS) + b')')
+    # The ALSA input could not be opened or read (card unplugged or
+    # renumbered). Routine warnings such as "ALSA buffer xrun." do not count.
+    # The reader prefix is "[alsa @" up to FFmpeg 5.x and "[in#1/alsa @" later;
+    # older versions report read errors as "<device>: Input/output error".
+    AUDIO_DEVICE_ERROR_RE = re.compile(
+        rb'cannot open audio device|ALSA read error|cannot recover from underrun|'
+        rb'(?:alsa @ [^\]]*\]|hw:\d+,\d+:).*Input/output error')
+    # FFmpeg could not open an encoder (the wording differs between versions)
+    ENCODER_ERROR_RE = re.compile(rb'Error while opening encoder|Error initializing output stream')
+    # Output counts as stalled when out_time has not advanced for this long
+    # (sec) although progress reports keep coming (FFmpeg 5+ muxes in a
+    # separate thread, so a blocked RTMP write no longer stops the reports)
+    OUTPUT_STALL_TIMEOUT = 20
+
+    def __init__(self, process, timeout=15, progress_fd=None):
         self.process = process
         self.timeout = timeout
-        self.last_activity = time.time()
-        self.running = True
+        self.last_activity = time.monotonic()
+        self._next_progress_log = 0
+        self._progress = {}
         self.rtmp_dead = False
+        self.eof = False
         self._rtmp_error_count = 0
-        self._stderr_log = stderr_log
-        self._thread = threading.Thread(target=self._reader, daemon=True)
-        self._thread.start()
-
-    def _reader(self):
+        self._non_monotonic = 0
+        self._out_time_us = None
+        self._output_advanced = self.last_activity
+        self.output_started = False
+        ffmpeg_log.warning('==== FFmpeg started (pid %d) ====', process.pid)
+        self._fd = process.stderr.fileno()
+        # Non-blocking so drain() can empty the pipe without ever stalling
+        os.set_blocking(self._fd, False)
+        # Grow the pipe from 64 KiB so FFmpeg never blocks on a stderr write
+        # while this process is busy elsewhere (F_SETPIPE_SZ is Linux-only)
         try:
-            for line in iter(self.process.stderr.readline, ''):
-                if not self.running:
-                    break
-                self.last_activity = time.time()
-                stripped = line.strip()
-                if not stripped:
-                    continue
-                # Always log stderr to file (not just in debug mode)
-                if self._stderr_log:
-                    try:
-                        with open(self._stderr_log, 'a') as f:
-                            f.write(time.strftime('%H:%M:%S') + ' ' + stripped + '\n')
-                    except Exception:
-                        pass
-                if DEBUG_MODE:
-                    logger.debug('FFmpeg: ' + stripped)
-                # Detect RTMP output errors
-                for pat in self.RTMP_ERROR_PATTERNS:
-                    if pat in stripped:
-                        self._rtmp_error_count += 1
-                        print('RTMP error (%d): %s' % (self._rtmp_error_count, stripped))
-                        if self._rtmp_error_count >= 3:
-                            self.rtmp_dead = True
-                        break
-        except Exception:
-            pass
+            fcntl.fcntl(self._fd, getattr(fcntl, 'F_SETPIPE_SZ', 1031), self.PIPE_SIZE)
+        except OSError:
+            pass  # above /proc/sys/fs/pipe-max-size; keep the default
+        self._pending = b''
+        # -progress key=value reports arrive on a pipe of their own
+        self.progress_fd = progress_fd
+        self._progress_pending = b''
+        if progress_fd is not None:
+            os.set_blocking(progress_fd, False)
+        # Reused for every read so steady-state draining allocates no read buffers
+        self._buf = bytearray(65536)
+        self._view = memoryview(self._buf)
+        # Last stderr lines (progress reports excluded) for error reports;
+        # bounded so hours of output never pile up in memory
+        self.recent_lines = deque(maxlen=64)
+
+    def fileno(self):
+        """stderr fd, so the watchdog can be registered with a selector"""
+        return self._fd
+
+    def drain(self):
+        """Consume everything readable on stderr. Returns False at EOF."""
+        alive, self._pending = self._drain_fd(self._fd, self._pending, self._handle_line)
+        if not alive:
+            self.eof = True
+        return alive
+
+    def drain_progress(self):
+        """Consume -progress reports. Returns False at EOF."""
+        alive, self._progress_pending = self._drain_fd(
+            self.progress_fd, self._progress_pending, self._handle_progress)
+        return alive
+
+    def _drain_fd(self, fd, pending, handle_line):
+        """Read fd until it is empty, passing each complete line to handle_line
+
+        Reads until the pipe is empty, so a burst larger than the buffer
+        is not left behind for another selector wakeup. Returns whether
+        the pipe is still open, and the trailing partial line.
+        """
+        while True:
+            try:
+                n = os.readv(fd, [self._buf])
+            except BlockingIOError:
+                return True, pending
+            except OSError:
+                n = 0
+            if not n:
+                return False, pending
+            self.last_activity = time.monotonic()
+            # bytes.splitlines() breaks on \n, \r and \r\n only (ffmpeg ends
+            # some lines with \r) in one pass, without a translated copy.
+            # Keep a trailing partial line for the next read.
+            data = pending + self._view[:n]
+            lines = data.splitlines()
+            pending = b'' if data.endswith((b'\n', b'\r')) else lines.pop()
+            for line in lines:
+                handle_line(line)
+            if n < len(self._buf):
+                return True, pending  # short read: the pipe is empty
+
+    def finish(self):
+        """Read the rest of stderr after FFmpeg has exited"""
+        if not self.eof:
+            os.set_blocking(self._fd, True)
+        while not self.eof:
+            self.drain()
+
+    def _handle_line(self, line):
+        match = self.LINE_CLASS_RE.search(line)
+        kind = match.lastgroup if match else None
+        if kind == 'non_monotonic':
+            # Log the first one, count the rest into the progress summary
+            self._non_monotonic += 1
+            if self._non_monotonic > 1:
+                return
+        stripped = line.strip()
+        if not stripped:
+            return
+        # Kept as bytes; decoding happens on the log thread or in tail()
+        self.recent_lines.append(stripped)
+        # Detect RTMP output errors
+        if kind != 'rtmp':
+            self._log(StderrLine(stripped))
+        else:
+            self._log(StderrLine(stripped), logging.WARNING)
+            self._rtmp_error_count += 1
+            print('RTMP error (%d): %s' % (self._rtmp_error_count, stripped.decode('utf-8', 'replace')))
+            if self._rtmp_error_count >= 3:
+                self.rtmp_dead = True
+
+    def _handle_progress(self, line):
+        # Reports arrive twice a second; apart from tracking whether the
+        # output advances, skip them until the next log window opens
+        if line.startswith(b'out_time_us='):
+            if line != self._out_time_us:
+                self._out_time_us = line
+                self._output_advanced = self.last_activity
+                if not self.output_started:
+                    # "N/A" and 0 until the first packet has been muxed
+                    value = line[len(b'out_time_us='):].strip()
+                    self.output_started = value.isdigit() and int(value) > 0
+        if self.last_activity >= self._next_progress_log:
+            self._collect_progress(line)
+
+    def _collect_progress(self, line):
+        """Gather one report block and log it as a single summary line"""
+        key, _, value = line.partition(b'=')
+        if key == b'progress':  # last line of a report block
+            self._next_progress_log = self.last_activity + self.PROGRESS_LOG_INTERVAL
+            parts = [k.decode() + '=' + self._progress[k].decode('utf-8', 'replace')
+                     for k in self.PROGRESS_LOG_KEYS if k in self._progress]
+            self._progress.clear()
+            if self._non_monotonic:
+                parts.append('non_monotonic=%d' % self._non_monotonic)
+                self._non_monotonic = 0
+            if parts:
+                self._log('progress: ' + ' '.join(parts))
+        elif key in self.PROGRESS_LOG_KEYS:
+            # Values can be space-padded (e.g. "speed=   1x")
+            fields = value.split(None, 1)
+            if fields:
+                self._progress[key] = fields[0]
+
+    def _log(self, text, level=logging.INFO):
+        # Always log stderr to file (not just in debug mode)
+        ffmpeg_log.log(level, '%s', text)
+        if DEBUG_MODE:
+            logger.debug('FFmpeg: %s', text)
+
+    def close(self):
+        """Close the progress pipe and mark the session end in the stderr log"""
+        if self.progress_fd is not None:
+            os.close(self.progress_fd)
+            self.progress_fd = None
+        # WARNING level so the batched log is flushed to disk now
+        ffmpeg_log.warning('==== FFmpeg session end (pid %d) ====', self.process.pid)
 
     def is_alive(self):
-        return (time.time() - self.last_activity) < self.timeout
+        return (time.monotonic() - self.last_activity) < self.timeout
+
+    def output_stalled(self):
+        """True if FFmpeg keeps reporting but its output has stopped advancing"""
+        return (self.progress_fd is not None and
+                time.monotonic() - self._output_advanced >= self.OUTPUT_STALL_TIMEOUT)
+
+    def audio_device_failed(self):
+        """True if the ALSA input recently failed to open or read"""
+        return any(self.AUDIO_DEVICE_ERROR_RE.search(line) for line in self.recent_lines)
+
+    def encoder_failed(self):
+        """True if FFmpeg recently failed to open an encoder"""
+        return any(self.ENCODER_ERROR_RE.search(line) for line in self.recent_lines)
 
-    def stop(self):
-        self.running = False
+    def seconds_left(self):
+        """Seconds until the hang timeout fires if FFmpeg stays silent"""
+        return self.last_activity + self.timeout - time.monotonic()
+
+    def tail(self, n=10):
+        """Return the last n stderr lines as one string"""
+        return b'\n'.join(list(self.recent_lines)[-n:]).decode('utf-8', 'replace')
 
 
 class YouTubeStreamer:
+    # カメラの取り込みサイズと配信映像（正方形）の一辺
+    # 画角とbird_counter_liteのROIがこの組み合わせ前提のため、取り込みは1280x720のまま
+    CAPTURE_WIDTH = 1280
+    CAPTURE_HEIGHT = 720
+    OUTPUT_SIZE = 720
+
+    # カメラ入力部分（セッションごとに変わらない）
+    FFMPEG_INPUT_ARGS = (
+        'ffmpeg',
+        '-nostdin',
+        # 進捗は -progress のkey=value出力だけで十分。同じ内容の"frame= ..."行は出さない
+        '-nostats',
+        # -progress の報告間隔（既定0.5秒）。ログの要約は1分ごと、無応答判定は
+        # 15秒・出力停止判定は20秒なので、その範囲で十分に間引ける（FFmpeg 4.4+）
+        '-stats_period', '2',
+        # MJPEGパケットは1つ100KB前後あるため、映像側は控えめに
+        '-thread_queue_size', '1024',
+        # 入力解析中のパケットを溜め込まず、最初のフレームからすぐ流す
+        '-fflags', 'nobuffer',
+        '-f', 'v4l2',
+        '-framerate', '30',
+        '-video_size', f'{CAPTURE_WIDTH}x{CAPTURE_HEIGHT}',
+        '-input_format', 'mjpeg',
+        # 720p30のMJPEGデコードはスレッドを増やしても効果が薄く、エンコーダとCPUを取り合うだけ
+        '-threads', '1',
+    )
+    # 映像エンコーダ候補（優先順）。libx264は最後のフォールバック
+    HW_VIDEO_ENCODERS = ('h264_v4l2m2m', 'h264_nvenc', 'h264_qsv')
+    # HWエンコーダ固有の追加オプション
+    # v4l2m2mは既定のバッファ数（出力16・キャプチャ4）だと30fpsで詰まりやすい
+    HW_ENCODER_ARGS = {
+        'h264_v4l2m2m': ('-num_output_buffers', '32', '-num_capture_buffers', '16'),
+    }
+    # libx264専用オプション（HWエンコーダは -preset ultrafast 等を受け付けない）
+    X264_ARGS = (
+        '-preset', 'ultrafast',
+        '-tune', 'zerolatency',
+    )
+    # 映像エンコード設定（全エンコーダ・RTMP単独・tee出力で共通）
+    VIDEO_ENCODE_ARGS = (
+        '-b:v', '1200k',
+        '-maxrate', '1200k',
+        '-bufsize', '2400k',
+        '-g', '60',
+        '-keyint_min', '60',
+        '-sc_threshold', '0',
+        '-pix_fmt', 'yuv420p',
+    )
+    # 音声エンコード設定
+    AUDIO_ENCODE_ARGS = (
+        '-c:a', 'aac',
+        '-b:a', '128k',
+        '-ar', '44100',
+        '-ac', '2',
+    )
+
+    # 音声デバイス・エンコーダの検出結果（再起動をまたいで再利用）
+    PROBE_CACHE_FILE = Path.home() / '.cache' / 'bird-watching-youtube-streamer' / 'probes.json'
+
     def __init__(self):
         self.stream_key = self._get_stream_key()
         self.stream_url = f"rtmp://a.rtmp.youtube.com/live2/{self.stream_key}"
@@ -106,9 +435,24 @@ class YouTubeStreamer:
         self.end_time = None
         self.use_audio = True
         self.max_session_duration = 8 * 3600  # 8時間で自動再接続
-        self.reconnect_delay = 30
-        self.max_reconnect_attempts = 5
+        # 起動確認の時間（秒）。これより早くFFmpegが終了したら起動失敗として扱う
+        self.startup_timeout = 5
+        # 起動失敗時の再試行間隔: 2, 4, 8...秒と倍増（上限60秒、0〜1秒のゆらぎ付き）
+        self.reconnect_base_delay = 2
+        self.reconnect_max_delay = 60
+        self.reconnect_reset_after = 300  # この秒数以上続いたセッションの後は間隔を初期値に戻す
+        # 連続して起動に失敗できる回数（起動に成功したら数え直す）。待機の合計
+        # 2+4+8+16+32+60+60 = 約3分で、一時的なカメラ・回線の不調をやり過ごす
+        self.max_reconnect_attempts = 7
+        # RTMP切断後、同じ枠で再接続するまでの待機（FFmpegは終了済みでデバイスも解放されている）
+        self.rtmp_retry_delay = 3
         self._cached_audio_cmd = None  # Cache audio device for reconnect
+        self.use_hw_encoder = '--no-hw-encode' not in sys.argv
+        # Raspberry PiのHW JPEGデコーダを使う（オプトイン。対応していない機種では起動に失敗する）
+        self.use_hw_mjpeg = '--hw-mjpeg' in sys.argv
+        # ライブでは使われないduration/filesizeの書き戻しを省略（問題があればFalseに）
+        self.flv_no_duration_filesize = True
+        self._cached_video_encoder = None  # Probed once per process
         self.session_start_time = None
         self.total_stream_time = 0
 
@@ -130,25 +474,56 @@ class YouTubeStreamer:
         self.current_topic = ""
         self.current_visit_info = ""
         self.current_stream_text = ""
+        # (mtime, size, inode) of each text file at its last read
+        self._text_file_sigs = {}
 
         # Watchdog settings
         self.watchdog = None
         self.watchdog_timeout = 15
+        # Waits on FFmpeg stderr in the monitor loop (no reader thread)
+        self._sel = selectors.DefaultSelector()
+        # Self-pipe for signal.set_wakeup_fd: SIGTERM/SIGINT wake the selector
+        self.stop_requested = False
+        self._wakeup_r, self._wakeup_w = os.pipe()
+        os.set_blocking(self._wakeup_r, False)
+        os.set_blocking(self._wakeup_w, False)
+        self._sel.register(self._wakeup_r, selectors.EVENT_READ, data='signal')
+        # pidfd of the running FFmpeg (Linux 5.3+); readable once it exits
+        self._ffmpeg_pidfd = None
+        self._shutdown_lock = threading.Lock()
         self.zmq_port = 5555
 
+    def install_signal_handlers(self):
+        """SIGTERM/SIGINTを監視ループで処理できるようにする"""
+        signal.set_wakeup_fd(self._wakeup_w)
+        signal.signal(signal.SIGTERM, self._on_stop_signal)
+        # Ctrl+C too: a KeyboardInterrupt could be raised anywhere, e.g.
+        # halfway through starting FFmpeg or while holding the log lock
+        signal.signal(signal.SIGINT, self._on_stop_signal)
+
+    def _on_stop_signal(self, signum, frame):
+        # Only record the request; the wakeup fd wakes the monitor loop,
+        # which stops FFmpeg from normal (non-signal) context
+        self.stop_requested = True
+
     def _get_stream_key(self):
         """ストリームキーを取得"""
         stream_key = os.environ.get('YOUTUBE_STREAM_KEY')
-        if not stream_key and os.path.exists('config.txt'):
+        if not stream_key:
+            # 1回の読み込みでKEY=VALUEをまとめて解析（ファイルが無ければ空扱い）
             try:
-                with open('config.txt', 'r', encoding='utf-8') as f:
-                    for line in f:
-                        if line.startswith('STREAM_KEY='):
-                            stream_key = line.split('=', 1)[1].strip()
-                            break
+                data = Path('config.txt').read_text(encoding='utf-8')
+            except FileNotFoundError:
+                data = ''
             except Exception as e:
+                data = ''
                 if DEBUG_MODE:
                     logger.error(f"config.txt読み込みエラー: {e}")
+            # partition() splits at the first '=' in one pass ('=' check included)
+            config = {key: value
+                      for key, sep, value in (line.partition('=') for line in data.splitlines())
+                      if sep and not key.startswith('#')}
+            stream_key = config.get('STREAM_KEY', '').strip()
 
         if not stream_key:
             print("エラー: ストリームキーが見つかりません")
@@ -182,9 +557,33 @@ class YouTubeStreamer:
                 f.write("Youtube登録お願いします")
             print(f"デフォルト自由記述ファイルを作成: {self.stream_text_file}")
 
+    def _file_changed(self, path):
+        """前回の読み込みからファイルが変わったか（statのみで判定）"""
+        try:
+            st = os.stat(path)
+            sig = (st.st_mtime_ns, st.st_size, st.st_ino)
+        except OSError:
+            sig = None  # missing: always re-read so the fallback applies
+        if sig is not None and self._text_file_sigs.get(path) == sig:
+            return False
+        self._text_file_sigs[path] = sig
+        return True
+
     def read_text_files(self):
-        """テキストファイルを読み込む"""
+        """テキストファイルを読み込む（変更のないファイルは読み直さない）"""
         # topic.txt
+        if self._file_changed(self.topic_file):
+            self._read_topic_file()
+
+        # visit_info.txt
+        if self._file_changed(self.visit_info_file):
+            self._read_visit_info_file()
+
+        # stream.txt
+        if self._file_changed(self.stream_text_file):
+            self._read_stream_text_file()
+
+    def _read_topic_file(self):
         try:
             with open(self.topic_file, 'r', encoding='utf-8') as f:
                 self.current_topic = f.readline().strip()
@@ -195,7 +594,7 @@ class YouTubeStreamer:
                 logger.error(f"トピックファイル読み込みエラー: {e}")
             self.current_topic = "配信中"
 
-        # visit_info.txt
+    def _read_visit_info_file(self):
         try:
             with open(self.visit_info_file, 'r', encoding='utf-8') as f:
                 data = json.load(f)
@@ -221,7 +620,7 @@ class YouTubeStreamer:
                 logger.error(f"訪問情報ファイル読み込みエラー: {e}")
             self.current_visit_info = "訪問情報取得中..."
 
-        # stream.txt
+    def _read_stream_text_file(self):
         try:
             with open(self.stream_text_file, 'r', encoding='utf-8') as f:
                 self.current_stream_text = f.readline().strip()
@@ -246,6 +645,14 @@ class YouTubeStreamer:
         # Reuse cached device on reconnect (skip ALSA probe)
         if self._cached_audio_cmd is not None:
             return self._cached_audio_cmd
+        # Across restarts, reuse the last result while the sound card list is unchanged
+        cache_key = self._alsa_cards_key()
+        cached = self._probe_cache_get('audio_input', cache_key)
+        if cached:
+            self._cached_audio_cmd = cached
+            if DEBUG_MODE:
+                logger.info(f"音声入力（キャッシュ）: {cached}")
+            return cached
         audio_inputs = [
             ['-f', 'alsa', '-ac', '1', '-i', 'plughw:2,0'],
             ['-f', 'alsa', '-i', 'plughw:2,0'],
@@ -253,22 +660,172 @@ class YouTubeStreamer:
             ['-f', 'alsa', '-i', 'hw:2,0'],
         ]
 
-        for audio_input in audio_inputs:
-            test_cmd = ['ffmpeg'] + audio_input + ['-t', '1', '-f', 'null', '-']
-            try:
-                result = subprocess.run(test_cmd, capture_output=True, timeout=3)
-                if result.returncode == 0:
-                    self._cached_audio_cmd = audio_input  # Cache it
-                    if DEBUG_MODE:
-                        logger.info(f"音声入力を検出: {audio_input}")
-                    return audio_input
-            except:
-                continue
+        # カードごとに並列で試す。同じカードの候補はhwデバイスが排他のため順番に
+        by_card = {}
+        for idx, audio_input in enumerate(audio_inputs):
+            card = audio_input[-1].split(':')[-1].split(',')[0]
+            by_card.setdefault(card, []).append((idx, audio_input))
+        with ThreadPoolExecutor(max_workers=len(by_card)) as pool:
+            found = [idx for idx in pool.map(self._probe_audio_card, by_card.values())
+                     if idx is not None]
+        if found:
+            # 候補リストの順（優先度）で一番先のものを採用
+            audio_input = audio_inputs[min(found)]
+            self._cached_audio_cmd = audio_input  # Cache it
+            self._probe_cache_put('audio_input', cache_key, audio_input)
+            if DEBUG_MODE:
+                logger.info(f"音声入力を検出: {audio_input}")
+            return audio_input
 
         if DEBUG_MODE:
             logger.warning("音声入力が見つかりません。無音で配信します")
         return ['-f', 'lavfi', '-i', 'anullsrc=channel_layout=stereo:sample_rate=44100']
 
+    def _forget_failed_audio_input(self):
+        """音声デバイスのエラーで終了した場合、キャッシュを捨てて次回は探し直す"""
+        if self._cached_audio_cmd is None or not self.watchdog.audio_device_failed():
+            return
+        if DEBUG_MODE:
+            logger.warning(f"音声入力でエラーが発生したため再検出します: {self._cached_audio_cmd}")
+        self._cached_audio_cmd = None
+        self._probe_cache_put('audio_input', self._alsa_cards_key(), None)
+
+    def _forget_failed_video_encoder(self):
+        """HWエンコーダを開けずに起動失敗した場合、キャッシュを捨てて次回は探し直す"""
+        if self._cached_video_encoder not in self.HW_VIDEO_ENCODERS or not self.watchdog.encoder_failed():
+            return
+        if DEBUG_MODE:
+            logger.warning(f"映像エンコーダを開けなかったため再検出します: {self._cached_video_encoder}")
+        self._cached_video_encoder = None
+        self._probe_cache_put('video_encoder', self._ffmpeg_binary_key(), None)
+
+    @staticmethod
+    def _probe_audio_card(candidates):
+        """Try one card's (index, input args) candidates in order; index of the first that works"""
+        for idx, audio_input in candidates:
+            # デバイスが開けて読めれば十分なので、録音は0.1秒だけ
+            test_cmd = [*FFMPEG_LAUNCH_PREFIX, 'ffmpeg', *audio_input, '-t', '0.1', '-f', 'null', '-']
+            try:
+                # 終了コードだけを見るので出力は捨てる（パイプの読み出しも不要）
+                result = subprocess.run(test_cmd, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                                        stderr=subprocess.DEVNULL, timeout=3)
+            except Exception:
+                continue
+            if result.returncode == 0:
+                return idx
+        return None
+
+    @staticmethod
+    def _alsa_cards_key():
+        """Cache key for the audio probe: the kernel's sound card list"""
+        try:
+            with open('/proc/asound/cards', encoding='utf-8') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    @staticmethod
+    def _ffmpeg_binary_key():
+        """Cache key for the encoder probe: which ffmpeg binary, and which build"""
+        path = shutil.which('ffmpeg')
+        if not path:
+            return None
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return f"{os.path.realpath(path)}:{st.st_size}:{st.st_mtime_ns}"
+
+    def _probe_cache_get(self, name, key):
+        """Cached probe result for name, or None if missing or recorded under another key"""
+        if key is None:
+            return None
+        try:
+            with open(self.PROBE_CACHE_FILE, encoding='utf-8') as f:
+                entry = json.load(f).get(name)
+        except (OSError, ValueError, AttributeError):
+            return None
+        if isinstance(entry, dict) and entry.get('key') == key:
+            return entry.get('value')
+        return None
+
+    def _probe_cache_put(self, name, key, value):
+        """Record a probe result; written via a temp file so readers never see half a file"""
+        if key is None:
+            return
+        try:
+            with open(self.PROBE_CACHE_FILE, encoding='utf-8') as f:
+                data = json.load(f)
+            if not isinstance(data, dict):
+                data = {}
+        except (OSError, ValueError):
+            data = {}
+        data[name] = {'key': key, 'value': value}
+        tmp = self.PROBE_CACHE_FILE.with_name(self.PROBE_CACHE_FILE.name + '.tmp')
+        try:
+            self.PROBE_CACHE_FILE.parent.mkdir(parents=True, exist_ok=True)
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(data, f)
+            os.replace(tmp, self.PROBE_CACHE_FILE)
+        except OSError:
+            pass  # cache is best effort
+
+    def crop_filter(self):
+        """取り込み映像の中央から配信サイズの正方形を切り出すcropフィルタ"""
+        x = (self.CAPTURE_WIDTH - self.OUTPUT_SIZE) // 2
+        y = (self.CAPTURE_HEIGHT - self.OUTPUT_SIZE) // 2
+        return f"crop={self.OUTPUT_SIZE}:{self.OUTPUT_SIZE}:{x}:{y}"
+
+    def get_video_encoder(self):
+        """映像エンコーダを選択（HWエンコーダ優先、使えなければlibx264）"""
+        if self._cached_video_encoder is not None:
+            return self._cached_video_encoder
+        encoder = 'libx264'
+        cache_key = self._ffmpeg_binary_key()
+        cached = self._probe_cache_get('video_encoder', cache_key) if self.use_hw_encoder else None
+        if cached in (*self.HW_VIDEO_ENCODERS, 'libx264'):
+            encoder = cached
+        elif self.use_hw_encoder:
+            try:
+                listed = subprocess.run([*FFMPEG_LAUNCH_PREFIX, 'ffmpeg', '-hide_banner', '-encoders'],
+                                        stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                                        stderr=subprocess.DEVNULL, timeout=5).stdout
+            except Exception:
+                listed = b''
+            # libx264を保存するのは、一覧が取れてHWエンコーダが1つも無い場合だけ。
+            # 試しエンコードの失敗は一時的なこともあるので（デバイス使用中など）、
+            # 次回の起動でもう一度試す
+            hw_listed = [c for c in self.HW_VIDEO_ENCODERS if c.encode() in listed]
+            for candidate in hw_listed:
+                # -encoders に載っていても実機で使えないことがある（例: Pi 5 は
+                # h264_v4l2m2m を持つがHWエンコーダが無い）ため、短い試し
+                # エンコードで確認する（入力は描画コストのほぼ無い単色で十分）
+                test_cmd = [*FFMPEG_LAUNCH_PREFIX, 'ffmpeg', '-hide_banner', '-f', 'lavfi',
+                            '-i', 'color=s=720x720:r=30', '-frames:v', '10',
+                            '-c:v', candidate, *self.HW_ENCODER_ARGS.get(candidate, ()),
+                            *self.VIDEO_ENCODE_ARGS, '-f', 'null', '-']
+                try:
+                    result = subprocess.run(test_cmd, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                                            stderr=subprocess.DEVNULL, timeout=10)
+                except Exception:
+                    continue
+                if result.returncode == 0:
+                    encoder = candidate
+                    break
+            if encoder != 'libx264' or (listed and not hw_listed):
+                self._probe_cache_put('video_encoder', cache_key, encoder)
+        self._cached_video_encoder = encoder
+        if DEBUG_MODE:
+            logger.info(f"映像エンコーダ: {encoder}")
+        return encoder
+
+    def get_video_encode_args(self):
+        """映像エンコーダ指定部分のFFmpeg引数"""
+        encoder = self.get_video_encoder()
+        if encoder == 'libx264':
+            return ['-c:v', encoder, *self.X264_ARGS, *self.VIDEO_ENCODE_ARGS]
+        return ['-c:v', encoder, *self.HW_ENCODER_ARGS.get(encoder, ()), *self.VIDEO_ENCODE_ARGS]
+
     def start_stream_session(self):
         """配信セッションを開始"""
         print("配信を開始します...")
@@ -289,20 +846,20 @@ class YouTubeStreamer:
         print("-" * 40)
 
         audio_cmd = self.get_audio_input()
+        video_encode_args = self.get_video_encode_args()
 
         # 基本のFFmpegコマンド
-        ffmpeg_cmd = [
-            'ffmpeg',
-            '-nostdin',
-            '-progress', 'pipe:2',
-            '-thread_queue_size', '512',
-            '-f', 'v4l2',
-            '-framerate', '30',
-            '-video_size', '1280x720',
-            '-input_format', 'mjpeg',
-            '-i', '/dev/video0',
-            '-thread_queue_size', '512'
-        ]
+        ffmpeg_cmd = [*self.FFMPEG_INPUT_ARGS]
+        if self.use_hw_mjpeg:
+            # デコード結果は通常のフレームなので、以降のcrop/drawtextはそのまま使える
+            ffmpeg_cmd.extend(['-c:v', 'mjpeg_v4l2m2m'])
+        ffmpeg_cmd.extend(['-i', '/dev/video0'])
+        # 音声パケットは小さいので大きめのキューで取りこぼし（Thread message queue blocking）を防ぐ
+        ffmpeg_cmd.extend(['-thread_queue_size', '4096'])
+        if 'alsa' in audio_cmd:
+            ffmpeg_cmd.extend(['-use_wallclock_as_timestamps', '1'])
+            # ALSAはPCMで形式が決まっているので、ストリーム解析をほぼ省いて起動を早める
+            ffmpeg_cmd.extend(['-fflags', 'nobuffer', '-probesize', '32', '-analyzeduration', '0'])
         ffmpeg_cmd.extend(audio_cmd)
 
         # フォントパス
@@ -328,15 +885,17 @@ class YouTubeStreamer:
         filter_complex = []
 
         # 基本フィルタ（クロップ）
-        filter_complex.append("[0:v]crop=720:720:280:0")
+        filter_complex.append(f"[0:v]{self.crop_filter()}")
 
         # 時刻（右下）
         filter_complex.append(f"drawtext=fontfile={font_file}:fontsize=24:fontcolor=white:box=1:boxcolor=black@0.7:boxborderw=5:x=w-text_w-10:y=h-text_h-10:text='%{{localtime}}'")
 
+        # 時刻以外の文字列は固定なので expansion=none（毎フレームの%{...}展開の解析を省く。
+        # 文字列中の % もそのまま表示される）
         # トピック（左上）
         if self.current_topic:
             escaped_topic = self.current_topic.replace("'", "\\'").replace(":", "\\:")
-            filter_complex.append(f"drawtext=fontfile={jp_font}:text='{escaped_topic}':fontsize=24:fontcolor=white:box=1:boxcolor=black@0.7:boxborderw=5:x=10:y=10")
+            filter_complex.append(f"drawtext=fontfile={jp_font}:text='{escaped_topic}':expansion=none:fontsize=24:fontcolor=white:box=1:boxcolor=black@0.7:boxborderw=5:x=10:y=10")
 
         # ZMQ control endpoint
         filter_complex.append("zmq")
@@ -350,102 +909,114 @@ class YouTubeStreamer:
         # 訪問情報（左上・トピック下）※空文字なら描画されない
         if self.current_visit_info:
             escaped_visit = self.current_visit_info.replace("'", "\\'").replace(":", "\\:")
-            filter_complex.append(f"drawtext=fontfile={jp_font}:text='{escaped_visit}':fontsize=24:fontcolor=yellow:box=1:boxcolor=black@0.7:boxborderw=5:x=10:y=45")
+            filter_complex.append(f"drawtext=fontfile={jp_font}:text='{escaped_visit}':expansion=none:fontsize=24:fontcolor=yellow:box=1:boxcolor=black@0.7:boxborderw=5:x=10:y=45")
 
         # Youtube登録（右上・右揃え）
         if self.current_stream_text:
             escaped_stream = self.current_stream_text.replace("'", "\\'").replace(":", "\\:")
-            filter_complex.append(f"drawtext=fontfile={jp_font}:text='{escaped_stream}':fontsize=24:fontcolor=white:box=1:boxcolor=black@0.7:boxborderw=5:x=w-text_w-10:y=10")
+            filter_complex.append(f"drawtext=fontfile={jp_font}:text='{escaped_stream}':expansion=none:fontsize=24:fontcolor=white:box=1:boxcolor=black@0.7:boxborderw=5:x=w-text_w-10:y=10")
 
         filter_str = ",".join(filter_complex)
 
         if self.enable_udp:
             # splitフィルタを使わずに、teeマルチプレクサを使用
             ffmpeg_cmd.extend(['-filter_complex', filter_str + "[processed]"])
+            ffmpeg_cmd.extend(['-map', '[processed]', '-map', '1:a?'])
+            ffmpeg_cmd.extend(video_encode_args)
+            ffmpeg_cmd.extend(self.AUDIO_ENCODE_ARGS)
+            flv_opts = 'f=flv:flvflags=no_duration_filesize' if self.flv_no_duration_filesize else 'f=flv'
             ffmpeg_cmd.extend([
-                '-map', '[processed]',
-                '-map', '1:a?',
-                '-c:v', 'libx264',
-                '-preset', 'ultrafast',
-                '-tune', 'zerolatency',
-                '-b:v', '1200k',
-                '-maxrate', '1200k',
-                '-bufsize', '2400k',
-                '-g', '60',
-                '-keyint_min', '60',
-                '-sc_threshold', '0',
-                '-pix_fmt', 'yuv420p',
-                '-c:a', 'aac',
-                '-b:a', '128k',
-                '-ar', '44100',
-                '-ac', '2',
                 '-f', 'tee',
-                f'[f=flv]{self.stream_url}|[f=mpegts:select=v]udp://{self.udp_address}:{self.udp_port}?pkt_size=1316'
+                f'[{flv_opts}]{self.stream_url}|[f=mpegts:select=v]udp://{self.udp_address}:{self.udp_port}?pkt_size=1316'
             ])
         else:
             ffmpeg_cmd.extend(['-vf', filter_str])
-            ffmpeg_cmd.extend([
-                '-c:v', 'libx264',
-                '-preset', 'ultrafast',
-                '-tune', 'zerolatency',
-                '-b:v', '1200k',
-                '-maxrate', '1200k',
-                '-bufsize', '2400k',
-                '-g', '60',
-                '-keyint_min', '60',
-                '-sc_threshold', '0',
-                '-pix_fmt', 'yuv420p',
-                '-c:a', 'aac',
-                '-b:a', '128k',
-                '-ar', '44100',
-                '-ac', '2',
-                '-f', 'flv',
-                self.stream_url
-            ])
+            ffmpeg_cmd.extend(video_encode_args)
+            ffmpeg_cmd.extend(self.AUDIO_ENCODE_ARGS)
+            if self.flv_no_duration_filesize:
+                ffmpeg_cmd.extend(['-flvflags', 'no_duration_filesize'])
+            ffmpeg_cmd.extend(['-f', 'flv', self.stream_url])
 
         try:
+            # -progress の key=value 出力はstderrとは別のパイプで受け取る
+            progress_r, progress_w = os.pipe()
+            ffmpeg_cmd[1:1] = ['-progress', f'pipe:{progress_w}']
+
             if DEBUG_MODE:
                 logger.info(f"FFmpegコマンド: {' '.join(ffmpeg_cmd)}")
 
-            self.ffmpeg_process = subprocess.Popen(
-                ffmpeg_cmd,
-                stdout=subprocess.DEVNULL,
-                stderr=subprocess.PIPE,  # Always capture for watchdog
-                universal_newlines=True,
-                encoding='utf-8',
-                bufsize=1
-            )
-
-            self.session_start_time = time.time()
-            time.sleep(5)
+            try:
+                self.ffmpeg_process = subprocess.Popen(
+                    [*FFMPEG_LAUNCH_PREFIX, *ffmpeg_cmd],
+                    stdout=subprocess.DEVNULL,
+                    stderr=subprocess.PIPE,  # Always capture for watchdog
+                    bufsize=0,  # Raw bytes; the watchdog splits and decodes lines
+                    pass_fds=(progress_w,)
+                )
+            except Exception:
+                os.close(progress_r)
+                raise
+            finally:
+                os.close(progress_w)  # only FFmpeg writes to it
+
+            # Start watchdog right away so startup errors are captured too
+            self._pin_ffmpeg_cpus()
+            self.watchdog = StderrWatchdog(self.ffmpeg_process, self.watchdog_timeout,
+                                           progress_fd=progress_r)
+            self._sel.register(self.watchdog, selectors.EVENT_READ, data='stderr')
+            self._sel.register(progress_r, selectors.EVENT_READ, data='progress')
+            self._open_pidfd()
+
+            self.session_start_time = time.monotonic()
+            self._wait_startup(self.startup_timeout)
 
             # 起動確認
             if self.ffmpeg_process and self.ffmpeg_process.poll() is not None:
                 print("エラー: 配信の開始に失敗しました")
-                self.ffmpeg_process = None
+                self.watchdog.finish()
+                if self.watchdog.recent_lines:
+                    print(self.watchdog.tail())
+                self._forget_failed_audio_input()
+                self._forget_failed_video_encoder()
+                self._release_watchdog()
+                self._close_pidfd()
+                self._shutdown_ffmpeg()
                 return False
 
-            # Start watchdog
-            stderr_logfile = str(LOG_DIR / ('ffmpeg_stderr_' + datetime.datetime.now().strftime('%Y%m%d_%H%M%S') + '.log'))
-            self.watchdog = StderrWatchdog(self.ffmpeg_process, self.watchdog_timeout, stderr_log=stderr_logfile)
-
             return True
 
         except Exception as e:
             print(f"エラー: {e}")
+            # Popen後に失敗した場合、起動済みのFFmpegとパイプを残さない
+            self.stop_stream_session()
             return False
 
     def monitor_stream(self):
         """配信を監視"""
-        last_status_time = time.time()
-        last_text_check = time.time()
+        # Intervals run on the monotonic clock so NTP steps cannot stretch
+        # or cut a session; only the scheduled end time is wall-clock
+        next_status_time = time.monotonic() + 60
+        last_text_check = time.monotonic()
+        # end_time is fixed for the session; compare plain floats per tick
+        end_ts = self.end_time.timestamp() if self.end_time else None
+
+        # The process does not change during a session; look it up once
+        process = self.ffmpeg_process
+        exited = process is None
+        while not exited:
+            # Without a pidfd, fall back to polling the exit status (one
+            # poll() per wakeup)
+            if self._ffmpeg_pidfd is None and process.poll() is not None:
+                break
+            if self.stop_requested:
+                print("終了シグナルを受信しました")
+                return "signal_shutdown"
 
-        while self.ffmpeg_process and self.ffmpeg_process.poll() is None:
             try:
-                current_time = time.time()
+                current_time = time.monotonic()
 
                 # 5秒ごとにテキストファイルをチェック
-                if current_time - last_text_check > 5:
+                if current_time - last_text_check >= 5:
                     # タイマーのリセットをブロックの最初に移動し、バグを修正
                     last_text_check = current_time
 
@@ -482,94 +1053,265 @@ class YouTubeStreamer:
                     print("RTMP接続エラーを検知。新しいBroadcastで再開するため終了します。")
                     return "rtmp_dead"
 
+                # 出力停止チェック（進捗は届くのに送出が進まない＝RTMPの書き込みが詰まっている）
+                if self.watchdog and self.watchdog.output_stalled():
+                    print(f"出力が{StderrWatchdog.OUTPUT_STALL_TIMEOUT}秒間進んでいません。RTMP接続断とみなします。")
+                    return "rtmp_dead"
+
                 # セッションタイムアウトチェック
-                if self.session_start_time and (current_time - self.session_start_time) > self.max_session_duration:
+                if self.session_start_time and (current_time - self.session_start_time) >= self.max_session_duration:
                     return "session_timeout"
 
                 # ステータス表示（1分ごと）
-                if current_time - last_status_time > 60:
-                    elapsed = int(current_time - self.session_start_time)
-                    print(f"配信中... ({elapsed//3600}時間{(elapsed%3600)//60}分経過)")
-                    last_status_time = current_time
+                if current_time >= next_status_time:
+                    print(f"配信中... ({self._fmt_hms(current_time - self.session_start_time)}経過)")
+                    next_status_time = current_time + 60
 
                 # 終了時刻チェック
-                if self.end_time and datetime.datetime.now() >= self.end_time:
+                if end_ts is not None and time.time() >= end_ts:
                     return "end_time_reached"
 
             except Exception as e:
                 if DEBUG_MODE:
-                    logger.warning(f"監視エラー: {e}")
-
-            time.sleep(0.5)
+                    # exc_info keeps the traceback; it is only rendered when logged
+                    logger.warning("監視エラー: %s", e, exc_info=True)
+
+            # Sleep until FFmpeg writes to stderr, a signal arrives, or the
+            # next check above is due (instead of polling every 0.5s)
+            for key, _ in self._sel.select(timeout=self._monitor_timeout(last_text_check, next_status_time, end_ts)):
+                if key.data == 'signal':
+                    self._clear_wakeup()
+                elif key.data == 'ffmpeg_exit':
+                    process.wait()  # already exited; just reap
+                    exited = True
+                elif key.data == 'progress':
+                    if not self.watchdog.drain_progress():
+                        self._sel.unregister(key.fd)
+                elif not key.fileobj.drain():
+                    self._sel.unregister(key.fileobj)  # EOF: FFmpeg is exiting
 
+        if self.watchdog:
+            self.watchdog.finish()
+            if self.watchdog.recent_lines:
+                print("FFmpegが終了しました。直近の出力:")
+                print(self.watchdog.tail())
+            self._forget_failed_audio_input()
         return "process_died"
 
-    def stop_stream_session(self):
-        """配信セッションを停止"""
+    @staticmethod
+    def _fmt_hms(seconds):
+        """経過秒数を「N時間M分」に整形"""
+        hours, rest = divmod(int(seconds), 3600)
+        return f"{hours}時間{rest // 60}分"
+
+    def _pin_ffmpeg_cpus(self):
+        """Move FFmpeg off the core this process is pinned to (when taskset is unavailable)"""
+        if not FFMPEG_CPUS or FFMPEG_LAUNCH_PREFIX:
+            return
+        # sched_setaffinity(pid) only covers the main thread; threads FFmpeg
+        # already started keep the old mask, so set it on each of them
+        try:
+            tids = os.listdir(f'/proc/{self.ffmpeg_process.pid}/task')
+        except OSError:
+            return  # already gone; the startup check reports it
+        for tid in tids:
+            try:
+                os.sched_setaffinity(int(tid), FFMPEG_CPUS)
+            except OSError:
+                pass
+
+    def _wait(self, seconds):
+        """指定秒数待機（停止シグナルを受けたらTrue）"""
+        # セッション間の待機と開始時刻までの待機に使う。シグナルの
+        # wakeup pipeで起きるので、待機中でもすぐに抜けられる
+        deadline = time.monotonic() + seconds
+        while not self.stop_requested:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            # Only the signal wakeup pipe is registered while no FFmpeg runs
+            for key, _ in self._sel.select(timeout=remaining):
+                if key.data == 'signal':
+                    self._clear_wakeup()
+        return True
+
+    def _wait_startup(self, seconds):
+        """FFmpegの起動を待つ"""
+        # 出力が流れ始めた時点、FFmpegが終了した時点、停止シグナルを受けた時点で
+        # seconds を待たずに戻る
+        deadline = time.monotonic() + seconds
+        while not self.stop_requested:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            if self._ffmpeg_pidfd is None:
+                # No pidfd to wake us on exit; check poll() at least twice a second
+                if self.ffmpeg_process.poll() is not None:
+                    return
+                remaining = min(remaining, 0.5)
+            for key, _ in self._sel.select(timeout=remaining):
+                if key.data == 'signal':
+                    self._clear_wakeup()
+                elif key.data == 'ffmpeg_exit':
+                    self.ffmpeg_process.wait()  # already exited; just reap
+                    return
+                elif key.data == 'progress':
+                    if not self.watchdog.drain_progress():
+                        self._sel.unregister(key.fd)
+                    elif self.watchdog.output_started:
+                        return
+                elif not key.fileobj.drain():
+                    self._sel.unregister(key.fileobj)
+
+    def _monitor_timeout(self, last_text_check, next_status_time, end_ts):
+        """Seconds until the next deadline monitor_stream has to act on"""
+        now = time.monotonic()
+        deadlines = [last_text_check + 5, next_status_time]
+        if self.session_start_time:
+            deadlines.append(self.session_start_time + self.max_session_duration)
+        timeout = min(deadlines) - now
+        if end_ts is not None:
+            timeout = min(timeout, end_ts - time.time())
+        if self.watchdog:
+            if self.watchdog.eof and self._ffmpeg_pidfd is None:
+                # stderr closed: FFmpeg is exiting, re-check poll() soon
+                timeout = min(timeout, 0.5)
+            else:
+                timeout = min(timeout, self.watchdog.seconds_left())
+        return max(timeout, 0)
+
+    def _open_pidfd(self):
+        """Watch for FFmpeg exit through the selector instead of poll()"""
+        if not hasattr(os, 'pidfd_open'):
+            return
+        try:
+            self._ffmpeg_pidfd = os.pidfd_open(self.ffmpeg_process.pid)
+        except OSError:
+            return  # kernel without pidfd support
+        self._sel.register(self._ffmpeg_pidfd, selectors.EVENT_READ, data='ffmpeg_exit')
+
+    def _close_pidfd(self):
+        if self._ffmpeg_pidfd is not None:
+            self._sel.unregister(self._ffmpeg_pidfd)
+            os.close(self._ffmpeg_pidfd)
+            self._ffmpeg_pidfd = None
+
+    def _clear_wakeup(self):
+        """Empty the signal wakeup pipe"""
+        try:
+            while os.read(self._wakeup_r, 512):
+                pass
+        except BlockingIOError:
+            pass
+
+    def _release_watchdog(self):
+        """Detach the watchdog from the selector"""
         if self.watchdog:
-            self.watchdog.stop()
-            self.watchdog = None
-        if self.ffmpeg_process and self.ffmpeg_process.poll() is None:
-            print("配信を停止します...")
-            self.ffmpeg_process.terminate()
             try:
-                self.ffmpeg_process.wait(timeout=10)
-            except subprocess.TimeoutExpired:
-                self.ffmpeg_process.kill()
-                self.ffmpeg_process.wait(timeout=5)
+                self._sel.unregister(self.watchdog)
+            except KeyError:
+                pass  # already unregistered at EOF
+            if self.watchdog.progress_fd is not None:
+                try:
+                    self._sel.unregister(self.watchdog.progress_fd)
+                except KeyError:
+                    pass
+            self.watchdog.close()
+            self.watchdog = None
+
+    def stop_stream_session(self):
+        """配信セッションを停止"""
+        self._release_watchdog()
+        self._close_pidfd()
+        self._shutdown_ffmpeg()
+
+    def _shutdown_ffmpeg(self, term_timeout=10, kill_timeout=5):
+        """FFmpegを終了させる（terminate→待機→kill）。何度呼んでも安全"""
+        with self._shutdown_lock:
+            process = self.ffmpeg_process
+            if process is None:
+                return
+            if process.poll() is None:
+                print("配信を停止します...")
+                process.terminate()
+                try:
+                    process.wait(timeout=term_timeout)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+                    process.wait(timeout=kill_timeout)
+            if process.stderr:
+                process.stderr.close()
             self.ffmpeg_process = None
 
     def start_stream(self):
         """配信を開始（再接続ループ付き）"""
-        reconnect_count = 0
+        reconnect_count = 0  # 連続した起動失敗の回数
+        backoff_step = 0  # 再試行間隔の倍増段階
         rtmp_retry_count = 0
         max_rtmp_retries = 3
-
-        while True:
-            if self.start_stream_session():
-                reconnect_count = 0
-                result = self.monitor_stream()
-
-                self.stop_stream_session()
-
-                if result == "session_timeout":
-                    rtmp_retry_count = 0
-                    print("セッションタイムアウト。再接続します")
-                    continue
-                elif result == "end_time_reached":
-                    print("終了時刻に達しました")
-                    break
-                elif result == "text_updated":
-                    rtmp_retry_count = 0
-                    print("テキスト更新のため再開します")
-                    continue
-                elif result == "watchdog_timeout":
-                    # Network instability needs cooldown before restart
-                    print("ハング検知。10秒待機後に再起動します...")
-                    time.sleep(10)
-                    continue
-                elif result == "rtmp_dead":
-                    rtmp_retry_count += 1
-                    if rtmp_retry_count <= max_rtmp_retries:
-                        print(f"RTMP切断 ({rtmp_retry_count}/{max_rtmp_retries})。10秒待機後に同じ枠で再接続...")
-                        time.sleep(10)
-                        continue
-                    else:
-                        print(f"RTMP切断が{max_rtmp_retries}回連続。新しい枠を作成します。")
-                        rtmp_retry_count = 0
-                        break
+        self.install_signal_handlers()
+
+        while not self.stop_requested:
+            started = self.start_stream_session()
+            if started:
+                try:
+                    result = self.monitor_stream()
+                finally:
+                    # 例外で抜けた場合もFFmpegとパイプを必ず片付ける
+                    self.stop_stream_session()
+                session_length = time.monotonic() - self.session_start_time
+                if session_length >= self.reconnect_reset_after:
+                    backoff_step = 0
+                # 起動確認は出力が始まった時点で打ち切るため、確認時間内の終了はここで
+                # 起動失敗として扱い、再試行の間隔と回数の制限に乗せる
+                if result == "process_died" and session_length < self.startup_timeout:
+                    print("エラー: 配信の開始に失敗しました（起動直後に終了）")
+                    started = False
                 else:
-                    break
-            else:
+                    reconnect_count = 0
+
+            if not started:
                 reconnect_count += 1
                 if reconnect_count > self.max_reconnect_attempts:
                     print("配信開始に失敗しました")
                     break
-                print(f"再接続を試みます... ({reconnect_count}/{self.max_reconnect_attempts})")
-                time.sleep(self.reconnect_delay)
+                delay = min(self.reconnect_max_delay,
+                            self.reconnect_base_delay * 2 ** backoff_step) + random.uniform(0, 1)
+                backoff_step += 1
+                print(f"{delay:.0f}秒後に再接続を試みます... ({reconnect_count}/{self.max_reconnect_attempts})")
+                self._wait(delay)
+            elif result == "session_timeout":
+                rtmp_retry_count = 0
+                print("セッションタイムアウト。再接続します")
+            elif result == "end_time_reached":
+                print("終了時刻に達しました")
+                break
+            elif result == "signal_shutdown":
+                print("配信を終了します")
+                break
+            elif result == "text_updated":
+                rtmp_retry_count = 0
+                print("テキスト更新のため再開します")
+            elif result == "watchdog_timeout":
+                # Network instability needs cooldown before restart
+                print("ハング検知。10秒待機後に再起動します...")
+                self._wait(10)
+            elif result == "rtmp_dead":
+                rtmp_retry_count += 1
+                if rtmp_retry_count <= max_rtmp_retries:
+                    print(f"RTMP切断 ({rtmp_retry_count}/{max_rtmp_retries})。{self.rtmp_retry_delay}秒待機後に同じ枠で再接続...")
+                    self._wait(self.rtmp_retry_delay)
+                else:
+                    print(f"RTMP切断が{max_rtmp_retries}回連続。新しい枠を作成します。")
+                    rtmp_retry_count = 0
+                    break
+            else:
+                break
 
     def schedule_stream(self, start_time_str=None, end_time_str=None):
         """スケジュール配信"""
+        # 開始時刻までの待機中もSIGTERM/SIGINTで即座に抜けられるように
+        self.install_signal_handlers()
         now = datetime.datetime.now()
 
         if not start_time_str:
@@ -596,9 +1338,14 @@ class YouTubeStreamer:
             print(f"配信スケジュール: {self.start_time.strftime('%H:%M')} - {self.end_time.strftime('%H:%M')}")
 
             if self.start_time > now:
-                wait_seconds = (self.start_time - now).total_seconds()
+                # start_time/end_timeは「その日の壁時計の時刻」（naive）のまま持ち、
+                # 秒数はtimestamp()（ローカルのタイムゾーン規則で変換）の差で求める。
+                # naive同士の引き算だと夏時間の切り替えをまたぐと1時間ずれる
+                wait_seconds = max(0, self.start_time.timestamp() - time.time())
                 print(f"開始時刻まで待機中... ({int(wait_seconds//60)}分)")
-                time.sleep(wait_seconds)
+                if self._wait(wait_seconds):
+                    print("配信を終了します")
+                    return
 
             self.start_stream()
 